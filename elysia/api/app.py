@@ -61,6 +61,8 @@ async def lifespan(app: FastAPI):
     yield
     scheduler.shutdown()
 
+    # flush imports that were already acknowledged before the clients close
+    await db.drain_async_inserts()
     await user_manager.close_all_clients()
 
 
@@ -1,23 +1,109 @@
-from fastapi import APIRouter, Depends, Body
-from fastapi.responses import JSONResponse
+import asyncio
+import hashlib
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Annotated
+
+import orjson
+from weaviate.client import WeaviateAsyncClient, WeaviateClient
+from weaviate.collections import Collection
+
+from fastapi import APIRouter, Depends, Header, Request
+from fastapi.responses import JSONResponse, Response
 
 from elysia.api.dependencies.common import get_user_manager
 from elysia.api.services.user import UserManager
+from elysia.util.client import ClientManager
 
 # Logging
 from elysia.api.core.log import logger
 
 router = APIRouter()
 
+# shared across responses; Starlette copies headers into each response
+_NO_CACHE_HEADERS = {"Cache-Control": "no-cache"}
+
+# Async insert queue: concurrent imports into the same (user_id, collection_name)
+# are coalesced into a single batch import, flushed on row count or wait time.
+ASYNC_INSERT_MAX_ROWS = 5000
+ASYNC_INSERT_WAIT_MS = 200
+# requests waiting per key before new imports are refused with 503
+ASYNC_INSERT_MAX_PENDING = 64
+# how long shutdown waits for queued imports to be flushed
+ASYNC_INSERT_DRAIN_TIMEOUT_SECONDS = 30
+
+# Defaults for the Weaviate fixed-size batcher used to insert a flush,
+# overridable per request via the batch-size / concurrent-requests headers
+IMPORT_BATCH_SIZE = 200
+IMPORT_CONCURRENT_REQUESTS = 4
+# upper bounds for those headers; a flush is shared by every caller coalesced into it.
+# 10 matches the Weaviate v4 client's own MAX_CONCURRENT_REQUESTS for dynamic batching
+IMPORT_MAX_BATCH_SIZE = 1000
+IMPORT_MAX_CONCURRENT_REQUESTS = 10
+
+_insert_queues: dict[tuple[str, str], asyncio.Queue] = {}
+_insert_workers: set[asyncio.Task] = set()
+
+# (user_id, collection_name) -> (async client that confirmed it, monotonic expiry).
+# A different client (e.g. after reset_keys points the user at another cluster)
+# counts as a miss. Bounded to COLLECTION_EXISTS_CACHE_MAX_SIZE entries.
+COLLECTION_EXISTS_TTL_SECONDS = 300
+COLLECTION_EXISTS_CACHE_MAX_SIZE = 1024
+_collection_exists_cache: dict[tuple[str, str], tuple[WeaviateAsyncClient, float]] = {}
+
+# (user_id, collection_name) -> (sync client, collection handle) used for batch imports.
+# Each handle owns a batcher with its own thread pool and fetches the collection config
+# on first use, so it is kept across the flushes of one burst (while the key's worker
+# runs and the client is not restarted) and evicted when the worker exits.
+_batch_collections: dict[tuple[str, str], tuple[WeaviateClient, Collection]] = {}
+
+
+@dataclass
+class _PendingInsert:
+    items: list[dict]
+    client_manager: ClientManager
+    batch_size: int = IMPORT_BATCH_SIZE
+    concurrent_requests: int = IMPORT_CONCURRENT_REQUESTS
+    future: asyncio.Future | None = None
+    errors: list[str] = field(default_factory=list)
+
+
+def _orjson_response(
+    content: dict, status_code: int, headers: dict = _NO_CACHE_HEADERS
+) -> Response:
+    return Response(
+        content=orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS),
+        status_code=status_code,
+        media_type="application/json",
+        headers=headers,
+    )
+
+
+def _etag_response(content: dict, if_none_match: str | None) -> Response:
+    """
+    Serialise content once and tag it with a hash of the body.
+    Returns 304 with no body when the client already holds the same version.
+    """
+    body = orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+    # no-cache still lets the browser store the response, but it revalidates every time
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+    if if_none_match is not None:
+        client_tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+        if etag in client_tags or "*" in client_tags:
+            return Response(status_code=304, headers=headers)
+
+    return Response(content=body, media_type="application/json", headers=headers)
+
 
 @router.get("/{user_id}/saved_trees")
 async def get_saved_trees(
     user_id: str,
     user_manager: UserManager = Depends(get_user_manager),
+    if_none_match: Annotated[str | None, Header()] = None,
 ):
-
-    headers = {"Cache-Control": "no-cache"}
-
     user = await user_manager.get_user_local(user_id)
     save_location_client_manager = user["frontend_config"].save_location_client_manager
     if not save_location_client_manager.is_client:
@@ -29,21 +115,21 @@ async def get_saved_trees(
         return JSONResponse(
             content={"trees": {}, "error": ""},
             status_code=200,
-            headers=headers,
+            headers=_NO_CACHE_HEADERS,
         )
 
     try:
         trees = await user_manager.get_saved_trees(
             user_id, save_location_client_manager
         )
-        return JSONResponse(
-            content={"trees": trees, "error": ""}, status_code=200, headers=headers
-        )
+        return _etag_response({"trees": trees, "error": ""}, if_none_match)
 
     except Exception as e:
         logger.error(f"Error getting saved trees: {str(e)}")
         return JSONResponse(
-            content={"trees": {}, "error": str(e)}, status_code=500, headers=headers
+            content={"trees": {}, "error": str(e)},
+            status_code=500,
+            headers=_NO_CACHE_HEADERS,
         )
 
 
@@ -52,23 +138,19 @@ async def load_tree(
     user_id: str,
     conversation_id: str,
     user_manager: UserManager = Depends(get_user_manager),
+    if_none_match: Annotated[str | None, Header()] = None,
 ):
-
-    headers = {"Cache-Control": "no-cache"}
-
     try:
         frontend_rebuild = await user_manager.load_tree(user_id, conversation_id)
-        return JSONResponse(
-            content={"rebuild": frontend_rebuild, "error": ""},
-            status_code=200,
-            headers=headers,
+        return _etag_response(
+            {"rebuild": frontend_rebuild, "error": ""}, if_none_match
         )
     except Exception as e:
         logger.error(f"Error loading tree: {str(e)}")
         return JSONResponse(
             content={"rebuild": [], "error": str(e)},
             status_code=500,
-            headers=headers,
+            headers=_NO_CACHE_HEADERS,
         )
 
 
@@ -100,11 +182,267 @@ async def delete_tree(
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
 
+_LIST_FIELDS = ("genres", "casts", "indexes")
+_YEAR_RE = re.compile(r"^\s*(\d{4})")
+
+
+def _norm_items(items: list[dict]) -> list[dict]:
+    """
+    Lightweight normalizer for imported objects, applied in place.
+    The items are freshly decoded from the request body, so they are not copied.
+    Keys with null or empty-string values are dropped (a missing property is empty),
+    and items left with no keys are omitted from the result (the import route reports
+    them as `skipped`).
+    """
+    year_match = _YEAR_RE.match
+    normalized = []
+    for x in items:
+        for k in [k for k, v in x.items() if v is None or v == ""]:
+            del x[k]
+        if not x:
+            continue
+        # arrays
+        for k in _LIST_FIELDS:
+            v = x.get(k)
+            if isinstance(v, str):
+                x[k] = [s for s in map(str.strip, v.split(",")) if s]
+        # platform nested: flatten selected platform fields
+        pf = x.get("platform")
+        if isinstance(pf, dict) and "name" in pf and "platform_name" not in x:
+            x["platform_name"] = pf["name"]
+        # year from date
+        date = x.get("date")
+        if isinstance(date, str) and x.get("year") is None:
+            m = year_match(date)
+            if m is not None:
+                x["year"] = int(m.group(1))
+        # age limit mapping
+        if "rtukRatingShort" in x and "ageLimit" not in x:
+            x["ageLimit"] = str(x["rtukRatingShort"]).strip()
+        normalized.append(x)
+    return normalized
+
+
+def _dedupe_items(items: list[dict]) -> tuple[list[dict], int]:
+    """
+    Drop items whose normalized content is identical to an earlier item.
+    Returns the unique items and how many duplicates were skipped.
+    """
+    option = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+    seen: set[bytes] = set()
+    unique = []
+    for it in items:
+        h = hashlib.blake2b(orjson.dumps(it, option=option), digest_size=16).digest()
+        if h not in seen:
+            seen.add(h)
+            unique.append(it)
+    return unique, len(items) - len(unique)
+
+
+def _cache_collection_exists(key: tuple[str, str], client: WeaviateAsyncClient) -> None:
+    now = time.monotonic()
+    _collection_exists_cache.pop(key, None)
+    if len(_collection_exists_cache) >= COLLECTION_EXISTS_CACHE_MAX_SIZE:
+        for k in [k for k, (_, expiry) in _collection_exists_cache.items() if expiry <= now]:
+            del _collection_exists_cache[k]
+        # still full: evict the oldest entries (dicts keep insertion order)
+        while len(_collection_exists_cache) >= COLLECTION_EXISTS_CACHE_MAX_SIZE:
+            del _collection_exists_cache[next(iter(_collection_exists_cache))]
+    _collection_exists_cache[key] = (client, now + COLLECTION_EXISTS_TTL_SECONDS)
+
+
+async def _ensure_collection(client: WeaviateAsyncClient, key: tuple[str, str]) -> None:
+    # Ensure collection exists (no vectorizer by default; inverted index timestamps enabled)
+    import weaviate.classes.config as wc
+
+    collection_name = key[1]
+    cached = _collection_exists_cache.get(key)
+    if cached is not None and cached[0] is client and cached[1] > time.monotonic():
+        return
+
+    if await client.collections.exists(collection_name):
+        _cache_collection_exists(key, client)
+        return
+
+    # Build a minimal flexible schema: create basic properties if common keys exist
+    props = []
+    common_text_fields = [
+        "name",
+        "description",
+        "type",
+        "channelGenre",
+        "poster",
+        "ageLimit",
+        "semantic_text",
+    ]
+    for p in common_text_fields:
+        props.append(wc.Property(name=p, data_type=wc.DataType.TEXT))
+    # arrays
+    for p in ["genres", "casts", "indexes"]:
+        props.append(wc.Property(name=p, data_type=wc.DataType.TEXT_ARRAY))
+    # numbers
+    for p in ["year", "contentId"]:
+        props.append(wc.Property(name=p, data_type=wc.DataType.NUMBER))
+    # extra platform_name as TEXT
+    props.append(wc.Property(name="platform_name", data_type=wc.DataType.TEXT))
+
+    await client.collections.create(
+        collection_name,
+        vectorizer_config=wc.Configure.Vectorizer.none(),
+        inverted_index_config=wc.Configure.inverted_index(index_timestamps=True),
+        properties=props,
+    )
+    _cache_collection_exists(key, client)
+
+
+def _batch_insert(
+    client_manager: ClientManager,
+    key: tuple[str, str],
+    items: list[dict],
+    batch_size: int,
+    concurrent_requests: int,
+) -> list[tuple[int, str]]:
+    """
+    Insert items with the sync client's fixed-size batcher, which sends batches
+    from its own worker threads. Returns (item index, message) for each failure.
+    """
+    with client_manager.connect_to_client() as client:
+        # flushes for one key are serialised by its worker, so its handle is never
+        # batched from two threads; different keys never share batch state
+        cached = _batch_collections.get(key)
+        if cached is not None and cached[0] is client:
+            collection = cached[1]
+        else:
+            collection = client.collections.get(key[1])
+            _batch_collections[key] = (client, collection)
+        with collection.batch.fixed_size(
+            batch_size=batch_size, concurrent_requests=concurrent_requests
+        ) as batch:
+            for it in items:
+                batch.add_object(properties=it)
+        failed = collection.batch.failed_objects
+
+    # BatchObject.index is the add_object position within this batch
+    return [(f.object_.index, str(f.message)) for f in failed]
+
+
+async def _flush_inserts(key: tuple[str, str], pending: list[_PendingInsert]) -> None:
+    """
+    Insert the items of all pending requests in one Weaviate batch import,
+    then split the per-object errors back onto the request they came from.
+    """
+    all_items = [it for p in pending for it in p.items]
+
+    async with pending[0].client_manager.connect_to_async_client() as client:
+        await _ensure_collection(client, key)
+
+    failed = await asyncio.to_thread(
+        _batch_insert,
+        pending[0].client_manager,
+        key,
+        all_items,
+        pending[0].batch_size,
+        pending[0].concurrent_requests,
+    )
+
+    # owner[i] is the request that sent item i
+    owner = [p for p in pending for _ in p.items]
+    for i, message in failed:
+        owner[i].errors.append(message)
+
+
+async def _async_insert_worker(
+    key: tuple[str, str], queue: asyncio.Queue[_PendingInsert]
+) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        pending = [await queue.get()]
+        rows = len(pending[0].items)
+        deadline = loop.time() + ASYNC_INSERT_WAIT_MS / 1000
+
+        while rows < ASYNC_INSERT_MAX_ROWS:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                nxt = await asyncio.wait_for(queue.get(), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+            pending.append(nxt)
+            rows += len(nxt.items)
+
+        try:
+            await _flush_inserts(key, pending)
+            for p in pending:
+                if p.future is None:
+                    if p.errors:
+                        logger.error(
+                            f"Async insert into {key[1]} for user {key[0]}: "
+                            f"{len(p.errors)} of {len(p.items)} objects failed"
+                        )
+                elif not p.future.done():
+                    p.future.set_result(p.errors)
+        except Exception as e:
+            # the collection may have been deleted elsewhere; re-check next time
+            _collection_exists_cache.pop(key, None)
+            _batch_collections.pop(key, None)
+            logger.exception(f"Error flushing async insert into {key[1]}")
+            for p in pending:
+                if p.future is not None and not p.future.done():
+                    p.future.set_exception(e)
+
+        # no await between the check and the removal, so a concurrent enqueue
+        # either lands before (and is drained) or starts a fresh worker
+        if queue.empty():
+            _insert_queues.pop(key, None)
+            _batch_collections.pop(key, None)
+            return
+
+
+def _enqueue_insert(key: tuple[str, str], entry: _PendingInsert) -> None:
+    """
+    Raises asyncio.QueueFull if ASYNC_INSERT_MAX_PENDING requests are already waiting.
+    """
+    queue = _insert_queues.get(key)
+    if queue is None:
+        queue = _insert_queues[key] = asyncio.Queue(maxsize=ASYNC_INSERT_MAX_PENDING)
+        task = asyncio.create_task(_async_insert_worker(key, queue))
+        _insert_workers.add(task)
+        task.add_done_callback(_insert_workers.discard)
+    queue.put_nowait(entry)
+
+
+async def drain_async_inserts(
+    timeout: float = ASYNC_INSERT_DRAIN_TIMEOUT_SECONDS,
+) -> None:
+    """
+    Wait for all queued imports to be flushed. Called on shutdown so imports that
+    were already acknowledged (including fire-and-forget ones) are not dropped.
+    """
+    if not _insert_workers:
+        return
+
+    _, unfinished = await asyncio.wait(list(_insert_workers), timeout=timeout)
+    if unfinished:
+        queued = sum(q.qsize() for q in _insert_queues.values())
+        logger.error(
+            f"Shutting down with {len(unfinished)} import workers still running "
+            f"and {queued} queued import requests not yet flushed"
+        )
+
+
 @router.post("/{user_id}/import/{collection_name}")
 async def import_collection_data(
     user_id: str,
     collection_name: str,
-    payload: dict = Body(...),
+    request: Request,
+    wait_for_async_insert: Annotated[bool, Header()] = True,
+    batch_size: Annotated[
+        int, Header(gt=0, le=IMPORT_MAX_BATCH_SIZE)
+    ] = IMPORT_BATCH_SIZE,
+    concurrent_requests: Annotated[
+        int, Header(gt=0, le=IMPORT_MAX_CONCURRENT_REQUESTS)
+    ] = IMPORT_CONCURRENT_REQUESTS,
     user_manager: UserManager = Depends(get_user_manager),
 ):
     """
@@ -116,102 +454,110 @@ async def import_collection_data(
       }
 
     Minimal normalization performed for arrays, year, age_limit, platform.
+    The body is decoded with orjson directly, skipping FastAPI's generic body parsing.
+
+    Items are queued and inserted together with other concurrent imports into the
+    same collection. Send the header `wait-for-async-insert: false` to return as soon
+    as the items are queued (status 202) instead of waiting for the insert.
+    If too many imports are already waiting for the collection, returns 503.
+    The `batch-size` (at most 1000) and `concurrent-requests` (at most 10) headers tune
+    the Weaviate batch import (the first request in a coalesced flush decides).
+    Items identical after normalization are inserted once; the number skipped is
+    returned as `duplicates`. Null and empty items are not inserted; their number is
+    returned as `skipped`.
     """
-    headers = {"Cache-Control": "no-cache"}
-
     try:
+        try:
+            payload = orjson.loads(await request.body())
+        except orjson.JSONDecodeError as e:
+            return _orjson_response(
+                {"inserted": 0, "errors": [f"invalid JSON body: {e}"], "error": ""},
+                status_code=400,
+            )
+
         user = await user_manager.get_user_local(user_id)
         client_manager = user["client_manager"]
 
-        items = payload.get("items")
+        items = payload.get("items") if isinstance(payload, dict) else None
         if not isinstance(items, list) or len(items) == 0:
-            return JSONResponse(
-                content={"inserted": 0, "errors": ["items must be a non-empty list"], "error": ""},
+            return _orjson_response(
+                {"inserted": 0, "errors": ["items must be a non-empty list"], "error": ""},
                 status_code=400,
-                headers=headers,
             )
 
-        # lightweight normalizer
-        def norm_item(obj: dict) -> dict:
-            x = dict(obj)
-            # arrays
-            for k in ["genres", "casts", "indexes"]:
-                if k in x and isinstance(x[k], str):
-                    x[k] = [s.strip() for s in x[k].split(",") if s.strip()]
-            # platform nested
-            if isinstance(x.get("platform"), dict):
-                # flatten selected platform fields
-                pf = x["platform"]
-                if "name" in pf and "platform_name" not in x:
-                    x["platform_name"] = pf.get("name")
-            # year from date
-            if "date" in x and isinstance(x["date"], str) and len(x["date"]) >= 4 and x.get("year") is None:
-                try:
-                    x["year"] = int(x["date"][0:4])
-                except Exception:
-                    pass
-            # age limit mapping
-            if "rtukRatingShort" in x and "ageLimit" not in x:
-                x["ageLimit"] = str(x["rtukRatingShort"]).strip()
-            return x
-
-        norm_items = [norm_item(it) for it in items]
-
-        # Insert
-        async with client_manager.connect_to_async_client() as client:
-            # Ensure collection exists (no vectorizer by default; inverted index timestamps enabled)
-            import weaviate.classes.config as wc
-
-            if not await client.collections.exists(collection_name):
-                # Build a minimal flexible schema: create basic properties if common keys exist
-                props = []
-                common_text_fields = [
-                    "name",
-                    "description",
-                    "type",
-                    "channelGenre",
-                    "poster",
-                    "ageLimit",
-                    "semantic_text",
-                ]
-                for p in common_text_fields:
-                    props.append(wc.Property(name=p, data_type=wc.DataType.TEXT))
-                # arrays
-                for p in ["genres", "casts", "indexes"]:
-                    props.append(wc.Property(name=p, data_type=wc.DataType.TEXT_ARRAY))
-                # numbers
-                for p in ["year", "contentId"]:
-                    props.append(wc.Property(name=p, data_type=wc.DataType.NUMBER))
-                # extra platform_name as TEXT
-                props.append(wc.Property(name="platform_name", data_type=wc.DataType.TEXT))
-
-                await client.collections.create(
-                    collection_name,
-                    vectorizer_config=wc.Configure.Vectorizer.none(),
-                    inverted_index_config=wc.Configure.inverted_index(index_timestamps=True),
-                    properties=props,
-                )
-
-            collection = client.collections.get(collection_name)
-            result = await collection.data.insert_many(norm_items)
-
-            inserted = 0
-            errors: list[str] = []
-            if hasattr(result, "has_errors") and result.has_errors:
-                errors = [str(e) for e in result.errors] if getattr(result, "errors", None) else ["insert_many failed"]
-            else:
-                inserted = len(norm_items)
-
-            return JSONResponse(
-                content={"inserted": inserted, "errors": errors, "error": ""},
-                status_code=200,
-                headers=headers,
+        if not all(it is None or isinstance(it, dict) for it in items):
+            return _orjson_response(
+                {"inserted": 0, "errors": ["items must be JSON objects"], "error": ""},
+                status_code=400,
             )
 
+        # drop empty objects before queueing so an all-empty payload never reaches Weaviate
+        # (_norm_items also drops objects whose values are all null or empty strings)
+        norm_items = _norm_items([it for it in items if it])
+        skipped = len(items) - len(norm_items)
+        if len(norm_items) == 0:
+            return _orjson_response(
+                {
+                    "inserted": 0,
+                    "skipped": skipped,
+                    "errors": ["no non-empty items"],
+                    "error": "",
+                },
+                status_code=400,
+            )
+        norm_items, duplicates = _dedupe_items(norm_items)
+
+        entry = _PendingInsert(
+            items=norm_items,
+            client_manager=client_manager,
+            batch_size=batch_size,
+            concurrent_requests=concurrent_requests,
+        )
+        if wait_for_async_insert:
+            entry.future = asyncio.get_running_loop().create_future()
+
+        try:
+            _enqueue_insert((user_id, collection_name), entry)
+        except asyncio.QueueFull:
+            return _orjson_response(
+                {
+                    "inserted": 0,
+                    "errors": ["too many pending imports for this collection"],
+                    "error": "",
+                },
+                status_code=503,
+                headers={**_NO_CACHE_HEADERS, "Retry-After": "1"},
+            )
+
+        if not wait_for_async_insert:
+            return _orjson_response(
+                {
+                    "inserted": 0,
+                    "queued": len(norm_items),
+                    "duplicates": duplicates,
+                    "skipped": skipped,
+                    "errors": [],
+                    "error": "",
+                },
+                status_code=202,
+            )
+
+        errors = await entry.future
+
+        return _orjson_response(
+            {
+                "inserted": len(norm_items) - len(errors),
+                "duplicates": duplicates,
+                "skipped": skipped,
+                "errors": errors,
+                "error": "",
+            },
+            status_code=200,
+        )
+
     except Exception as e:
         logger.exception("Error importing data")
-        return JSONResponse(
-            content={"inserted": 0, "errors": [str(e)], "error": str(e)},
+        return _orjson_response(
+            {"inserted": 0, "errors": [str(e)], "error": str(e)},
             status_code=500,
-            headers=headers,
         )
@@ -0,0 +1,573 @@
+import asyncio
+import pytest
+import orjson
+from contextlib import asynccontextmanager, contextmanager
+from uuid import uuid4
+
+from fastapi.responses import Response
+from weaviate.collections.classes.batch import BatchObject, ErrorObject
+
+from elysia.api.routes import db
+from elysia.api.routes.db import import_collection_data
+
+
+def read_response(response: Response):
+    return orjson.loads(response.body)
+
+
+class fake_request:
+    def __init__(self, payload: dict):
+        self._body = orjson.dumps(payload)
+
+    async def body(self) -> bytes:
+        return self._body
+
+
+class fake_client_manager:
+    @asynccontextmanager
+    async def connect_to_async_client(self):
+        yield None
+
+
+class fake_user_manager:
+    def __init__(self):
+        self.client_manager = fake_client_manager()
+
+    async def get_user_local(self, user_id: str):
+        return {"client_manager": self.client_manager}
+
+
+class fake_batch_insert:
+    """
+    Stands in for db._batch_insert: records every flush and fails any item
+    that has "fail": True, or raises for the whole flush if `raises` is set.
+    """
+
+    def __init__(self, raises: Exception | None = None):
+        self.flushes = []
+        self.raises = raises
+
+    def __call__(self, client_manager, key, items, batch_size, concurrent_requests):
+        self.flushes.append([it["name"] for it in items])
+        if self.raises is not None:
+            raise self.raises
+        return [
+            (i, f"failed {it['name']}") for i, it in enumerate(items) if it.get("fail")
+        ]
+
+
+@pytest.fixture
+def batch_insert(monkeypatch):
+    async def ensure_collection(client, key):
+        return None
+
+    fake = fake_batch_insert()
+    monkeypatch.setattr(db, "_batch_insert", fake)
+    monkeypatch.setattr(db, "_ensure_collection", ensure_collection)
+    monkeypatch.setattr(db, "ASYNC_INSERT_WAIT_MS", 50)
+    return fake
+
+
+async def do_import(collection_name: str, items: list[dict], **kwargs):
+    return await import_collection_data(
+        user_id="test_user_import",
+        collection_name=collection_name,
+        request=fake_request({"items": items}),
+        user_manager=fake_user_manager(),
+        **kwargs,
+    )
+
+
+async def wait_for_workers():
+    await asyncio.gather(*list(db._insert_workers))
+
+
+class TestAsyncInsertQueue:
+
+    @pytest.mark.asyncio
+    async def test_concurrent_imports_share_one_flush(self, batch_insert):
+        collection_name = f"Test_{uuid4().hex}"
+
+        response_a, response_b = await asyncio.gather(
+            do_import(collection_name, [{"name": "a1"}, {"name": "a2", "fail": True}]),
+            do_import(collection_name, [{"name": "b1"}, {"name": "b2"}]),
+        )
+
+        assert batch_insert.flushes == [["a1", "a2", "b1", "b2"]]
+
+        assert response_a.status_code == 200
+        assert read_response(response_a)["inserted"] == 1
+        assert read_response(response_a)["errors"] == ["failed a2"]
+
+        assert response_b.status_code == 200
+        assert read_response(response_b)["inserted"] == 2
+        assert read_response(response_b)["errors"] == []
+
+    @pytest.mark.asyncio
+    async def test_errors_split_across_requests(self, batch_insert):
+        collection_name = f"Test_{uuid4().hex}"
+
+        response_a, response_b = await asyncio.gather(
+            do_import(collection_name, [{"name": "a1"}]),
+            do_import(collection_name, [{"name": "b1", "fail": True}]),
+        )
+
+        assert len(batch_insert.flushes) == 1
+        assert read_response(response_a)["errors"] == []
+        assert read_response(response_a)["inserted"] == 1
+        assert read_response(response_b)["errors"] == ["failed b1"]
+        assert read_response(response_b)["inserted"] == 0
+
+    @pytest.mark.asyncio
+    async def test_flush_on_row_threshold(self, batch_insert, monkeypatch):
+        collection_name = f"Test_{uuid4().hex}"
+        monkeypatch.setattr(db, "ASYNC_INSERT_MAX_ROWS", 2)
+        monkeypatch.setattr(db, "ASYNC_INSERT_WAIT_MS", 60_000)
+
+        # reaching the row limit flushes without waiting out the timer
+        response = await asyncio.wait_for(
+            do_import(collection_name, [{"name": "a1"}, {"name": "a2"}]),
+            timeout=5,
+        )
+        assert read_response(response)["inserted"] == 2
+        assert batch_insert.flushes == [["a1", "a2"]]
+
+    @pytest.mark.asyncio
+    async def test_flush_on_wait_threshold(self, batch_insert):
+        collection_name = f"Test_{uuid4().hex}"
+
+        # a lone small request is flushed once the wait time passes
+        response = await asyncio.wait_for(
+            do_import(collection_name, [{"name": "a1"}]), timeout=5
+        )
+        assert read_response(response)["inserted"] == 1
+        assert batch_insert.flushes == [["a1"]]
+
+    @pytest.mark.asyncio
+    async def test_worker_exits_and_respawns(self, batch_insert):
+        collection_name = f"Test_{uuid4().hex}"
+        key = ("test_user_import", collection_name)
+
+        # stands in for the handle the real _batch_insert caches during the burst
+        db._batch_collections[key] = (None, None)
+        await do_import(collection_name, [{"name": "a1"}])
+        await wait_for_workers()
+        assert key not in db._insert_queues
+        assert key not in db._batch_collections
+
+        response = await do_import(collection_name, [{"name": "b1"}])
+        assert read_response(response)["inserted"] == 1
+        assert batch_insert.flushes == [["a1"], ["b1"]]
+
+        await wait_for_workers()
+        assert key not in db._insert_queues
+
+    @pytest.mark.asyncio
+    async def test_fire_and_forget(self, batch_insert):
+        collection_name = f"Test_{uuid4().hex}"
+
+        response = await do_import(
+            collection_name,
+            [{"name": "a1"}, {"name": "a2"}],
+            wait_for_async_insert=False,
+        )
+        assert response.status_code == 202
+        assert read_response(response)["inserted"] == 0
+        assert read_response(response)["queued"] == 2
+        assert batch_insert.flushes == []
+
+        await wait_for_workers()
+        assert batch_insert.flushes == [["a1", "a2"]]
+
+    @pytest.mark.asyncio
+    async def test_full_queue_refused(self, batch_insert, monkeypatch):
+        collection_name = f"Test_{uuid4().hex}"
+        monkeypatch.setattr(db, "ASYNC_INSERT_MAX_PENDING", 1)
+
+        # the worker has not run yet, so the first request still fills the queue
+        response = await do_import(
+            collection_name, [{"name": "a1"}], wait_for_async_insert=False
+        )
+        assert response.status_code == 202
+
+        response = await do_import(
+            collection_name, [{"name": "b1"}], wait_for_async_insert=False
+        )
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "1"
+        assert read_response(response)["inserted"] == 0
+
+        await wait_for_workers()
+        assert batch_insert.flushes == [["a1"]]
+
+    @pytest.mark.asyncio
+    async def test_drain_flushes_queued_imports(self, batch_insert):
+        collection_name = f"Test_{uuid4().hex}"
+
+        await do_import(collection_name, [{"name": "a1"}], wait_for_async_insert=False)
+        await do_import(collection_name, [{"name": "b1"}], wait_for_async_insert=False)
+        assert batch_insert.flushes == []
+
+        await db.drain_async_inserts(timeout=5)
+        assert batch_insert.flushes == [["a1", "b1"]]
+        assert db._insert_workers == set()
+
+    @pytest.mark.asyncio
+    async def test_failed_flush_fails_every_request(self, batch_insert):
+        collection_name = f"Test_{uuid4().hex}"
+        key = ("test_user_import", collection_name)
+        batch_insert.raises = RuntimeError("weaviate unavailable")
+        db._collection_exists_cache[key] = (None, float("inf"))
+
+        response_a, response_b = await asyncio.gather(
+            do_import(collection_name, [{"name": "a1"}]),
+            do_import(collection_name, [{"name": "b1"}]),
+        )
+
+        for response in [response_a, response_b]:
+            assert response.status_code == 500
+            assert read_response(response)["inserted"] == 0
+            assert read_response(response)["error"] == "weaviate unavailable"
+
+        # the existence cache is cleared so the next flush re-checks the collection
+        assert key not in db._collection_exists_cache
+
+
+class fake_collection_batch:
+    """
+    Mimics collection.batch: failed_objects is reset per batch and, like the
+    real client, reports original_uuid as a str while add_object returns a UUID.
+    """
+
+    def __init__(self, collection_name: str):
+        self.collection_name = collection_name
+        self.failed_objects = []
+
+    def fixed_size(self, batch_size: int, concurrent_requests: int):
+        self.added = []
+        self.failed_objects = []
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for i, (uuid, properties) in enumerate(self.added):
+            if properties.get("fail"):
+                self.failed_objects.append(
+                    ErrorObject(
+                        message=f"failed {properties['name']}",
+                        object_=BatchObject(
+                            collection=self.collection_name,
+                            properties=properties,
+                            uuid=uuid,
+                            index=i,
+                        ),
+                        original_uuid=str(uuid),
+                    )
+                )
+
+    def add_object(self, properties: dict):
+        uuid = uuid4()
+        self.added.append((uuid, properties))
+        return uuid
+
+
+class fake_collection:
+    def __init__(self, collection_name: str):
+        self.batch = fake_collection_batch(collection_name)
+
+
+class fake_collections:
+    def __init__(self):
+        self.get_calls = 0
+
+    def get(self, collection_name: str):
+        self.get_calls += 1
+        return fake_collection(collection_name)
+
+
+class fake_sync_client:
+    def __init__(self):
+        self.collections = fake_collections()
+
+
+class fake_sync_client_manager:
+    def __init__(self):
+        self.client = fake_sync_client()
+
+    @contextmanager
+    def connect_to_client(self):
+        yield self.client
+
+
+class TestBatchInsert:
+
+    def test_failures_map_to_item_index(self):
+        client_manager = fake_sync_client_manager()
+        key = ("test_user_import", f"Test_{uuid4().hex}")
+        items = [
+            {"name": "a1"},
+            {"name": "a2", "fail": True},
+            {"name": "b1"},
+            {"name": "b2", "fail": True},
+        ]
+
+        failed = db._batch_insert(client_manager, key, items, 2, 1)
+        assert failed == [(1, "failed a2"), (3, "failed b2")]
+
+    def test_collection_handle_reused_until_client_restart(self):
+        client_manager = fake_sync_client_manager()
+        key = ("test_user_import", f"Test_{uuid4().hex}")
+
+        db._batch_insert(client_manager, key, [{"name": "a1", "fail": True}], 2, 1)
+        failed = db._batch_insert(client_manager, key, [{"name": "b1"}], 2, 1)
+        assert client_manager.client.collections.get_calls == 1
+        # failures from an earlier flush are not reported again
+        assert failed == []
+
+        # a restarted client gets a fresh handle
+        client_manager.client = fake_sync_client()
+        db._batch_insert(client_manager, key, [{"name": "c1"}], 2, 1)
+        assert client_manager.client.collections.get_calls == 1
+        assert db._batch_collections[key][0] is client_manager.client
+
+
+class TestNormItems:
+
+    def test_list_fields_split(self):
+        items = db._norm_items(
+            [{"genres": "drama, comedy,, ", "casts": "a,b", "indexes": ["movie"]}]
+        )
+        assert items[0]["genres"] == ["drama", "comedy"]
+        assert items[0]["casts"] == ["a", "b"]
+        assert items[0]["indexes"] == ["movie"]
+
+    def test_year_from_date(self):
+        items = db._norm_items(
+            [
+                {"date": "2019-05-01"},
+                {"date": "2019-05-01", "year": 2020},
+                {"date": "unknown"},
+                {"date": "19"},
+            ]
+        )
+        assert items[0]["year"] == 2019
+        assert items[1]["year"] == 2020
+        assert "year" not in items[2]
+        assert "year" not in items[3]
+
+    def test_platform_name_and_age_limit(self):
+        items = db._norm_items(
+            [
+                {"platform": {"name": "Tabii"}, "rtukRatingShort": " 13+ "},
+                {
+                    "platform": {"name": "Tabii"},
+                    "platform_name": "kept",
+                    "rtukRatingShort": "7+",
+                    "ageLimit": "kept",
+                },
+                {"platform": "Tabii"},
+            ]
+        )
+        assert items[0]["platform_name"] == "Tabii"
+        assert items[0]["ageLimit"] == "13+"
+        assert items[1]["platform_name"] == "kept"
+        assert items[1]["ageLimit"] == "kept"
+        assert "platform_name" not in items[2]
+
+    def test_empty_values_dropped(self):
+        items = db._norm_items(
+            [{"name": "a", "description": "", "poster": None, "year": 0, "casts": []}]
+        )
+        assert items == [{"name": "a", "year": 0, "casts": []}]
+
+    def test_all_empty_items_omitted(self):
+        items = db._norm_items([{"name": "a"}, {"name": "", "poster": None}, {}])
+        assert items == [{"name": "a"}]
+
+    @pytest.mark.asyncio
+    async def test_all_empty_items_rejected(self, batch_insert):
+        response = await do_import(
+            f"Test_{uuid4().hex}", [{"name": ""}, {"poster": None}, {}]
+        )
+        assert response.status_code == 400
+        assert read_response(response)["errors"] == ["no non-empty items"]
+        assert read_response(response)["skipped"] == 3
+        assert batch_insert.flushes == []
+
+    @pytest.mark.asyncio
+    async def test_items_emptied_by_normalization_skipped(self, batch_insert):
+        response = await do_import(
+            f"Test_{uuid4().hex}",
+            [{"name": "a"}, {"name": "", "poster": None}, {"casts": None}],
+        )
+        assert response.status_code == 200
+        assert read_response(response)["inserted"] == 1
+        assert read_response(response)["skipped"] == 2
+        assert batch_insert.flushes == [["a"]]
+
+    @pytest.mark.asyncio
+    async def test_non_object_items_rejected(self, batch_insert):
+        response = await do_import(f"Test_{uuid4().hex}", [{"name": "a"}, "abc", 1])
+        assert response.status_code == 400
+        assert read_response(response)["errors"] == ["items must be JSON objects"]
+        assert batch_insert.flushes == []
+
+
+class TestDedupeItems:
+
+    def test_reordered_duplicates_collapsed(self):
+        items, duplicates = db._dedupe_items(
+            [
+                {"name": "a", "genres": ["x", "y"]},
+                {"genres": ["x", "y"], "name": "a"},
+                {"name": "a", "genres": ["y", "x"]},
+                {"name": "b"},
+                {"name": "a", "genres": ["x", "y"]},
+            ]
+        )
+        assert items == [
+            {"name": "a", "genres": ["x", "y"]},
+            {"name": "a", "genres": ["y", "x"]},
+            {"name": "b"},
+        ]
+        assert duplicates == 2
+
+    @pytest.mark.asyncio
+    async def test_duplicates_reported(self, batch_insert):
+        response = await do_import(
+            f"Test_{uuid4().hex}",
+            [{"name": "a", "year": 2000}, {"year": 2000, "name": "a"}, {"name": "b"}],
+        )
+        assert read_response(response)["inserted"] == 2
+        assert read_response(response)["duplicates"] == 1
+        assert batch_insert.flushes == [["a", "b"]]
+
+    @pytest.mark.asyncio
+    async def test_skipped_items_reported(self, batch_insert):
+        items = [{"name": "a"}, {}, None, {"name": "", "poster": None}, {"name": "a"}]
+        response = await do_import(f"Test_{uuid4().hex}", items)
+        assert response.status_code == 200
+        body = read_response(response)
+        assert body["inserted"] == 1
+        assert body["duplicates"] == 1
+        assert body["skipped"] == 3
+        assert body["inserted"] + body["duplicates"] + body["skipped"] == len(items)
+        assert batch_insert.flushes == [["a"]]
+
+    @pytest.mark.asyncio
+    async def test_skipped_items_reported_when_queued(self, batch_insert):
+        response = await do_import(
+            f"Test_{uuid4().hex}",
+            [{"name": "a"}, None, {}, {"name": "a"}],
+            wait_for_async_insert=False,
+        )
+        assert response.status_code == 202
+        assert read_response(response)["queued"] == 1
+        assert read_response(response)["duplicates"] == 1
+        assert read_response(response)["skipped"] == 2
+
+        await wait_for_workers()
+        assert batch_insert.flushes == [["a"]]
+
+
+class fake_async_collections:
+    def __init__(self):
+        self.exists_calls = 0
+
+    async def exists(self, collection_name: str) -> bool:
+        self.exists_calls += 1
+        return True
+
+
+class fake_async_client:
+    def __init__(self):
+        self.collections = fake_async_collections()
+
+
+class TestCollectionExistsCache:
+
+    @pytest.mark.asyncio
+    async def test_exists_cached_per_client(self):
+        key = ("test_user_import", f"Test_{uuid4().hex}")
+        client = fake_async_client()
+
+        await db._ensure_collection(client, key)
+        await db._ensure_collection(client, key)
+        assert client.collections.exists_calls == 1
+
+        # a different client (e.g. after reset_keys) re-checks the collection
+        other_client = fake_async_client()
+        await db._ensure_collection(other_client, key)
+        assert other_client.collections.exists_calls == 1
+        assert db._collection_exists_cache[key][0] is other_client
+
+    @pytest.mark.asyncio
+    async def test_expired_entry_rechecked(self, monkeypatch):
+        key = ("test_user_import", f"Test_{uuid4().hex}")
+        client = fake_async_client()
+        monkeypatch.setattr(db, "COLLECTION_EXISTS_TTL_SECONDS", -1)
+
+        await db._ensure_collection(client, key)
+        await db._ensure_collection(client, key)
+        assert client.collections.exists_calls == 2
+
+    def test_cache_bounded(self, monkeypatch):
+        monkeypatch.setattr(db, "_collection_exists_cache", {})
+        monkeypatch.setattr(db, "COLLECTION_EXISTS_CACHE_MAX_SIZE", 2)
+        client = fake_async_client()
+
+        for name in ["a", "b", "c"]:
+            db._cache_collection_exists(("test_user_import", name), client)
+
+        assert list(db._collection_exists_cache) == [
+            ("test_user_import", "b"),
+            ("test_user_import", "c"),
+        ]
+
+
+@pytest.fixture
+def http_client(batch_insert):
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from elysia.api.dependencies.common import get_user_manager
+
+    app = FastAPI()
+    app.include_router(db.router)
+    app.dependency_overrides[get_user_manager] = fake_user_manager
+
+    with TestClient(app) as client:
+        yield client
+
+
+class TestImportHeaders:
+
+    @pytest.mark.parametrize(
+        "headers",
+        [
+            {"concurrent-requests": "100000"},
+            {"concurrent-requests": "0"},
+            {"batch-size": "1000000"},
+        ],
+    )
+    def test_out_of_range_batch_headers_rejected(
+        self, http_client, batch_insert, headers
+    ):
+        response = http_client.post(
+            f"/test_user_import/import/Test_{uuid4().hex}",
+            json={"items": [{"name": "a1"}]},
+            headers=headers,
+        )
+        assert response.status_code == 422
+        assert batch_insert.flushes == []
+
+    def test_in_range_batch_headers_accepted(self, http_client, batch_insert):
+        response = http_client.post(
+            f"/test_user_import/import/Test_{uuid4().hex}",
+            json={"items": [{"name": "a1"}]},
+            headers={"batch-size": "1000", "concurrent-requests": "10"},
+        )
+        assert response.status_code == 200
+        assert response.json()["inserted"] == 1
+        assert batch_insert.flushes == [["a1"]]
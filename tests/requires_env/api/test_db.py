@@ -130,6 +130,16 @@ class TestSaveLoad:
                 if "user_id" in rebuilt:
                     assert rebuilt["user_id"] == user_id
 
+            # revalidating with the returned ETag gives a 304 with no body
+            response = await load_tree(
+                user_id=user_id,
+                conversation_id=conversation_id,
+                user_manager=user_manager,
+                if_none_match=response.headers["etag"],
+            )
+            assert response.status_code == 304
+            assert response.body == b""
+
             response = await get_saved_trees(
                 user_id=user_id,
                 user_manager=user_manager,